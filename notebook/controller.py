@@ -1,78 +1,82 @@
+import copy
 import numpy
 import rospy
 import random
 from std_msgs.msg import Header
 from sensor_msgs.msg import JointState
-from geometry_msgs.msg import TransformStamped, Transform, Quaternion, Vector3, Point
+from geometry_msgs.msg import TransformStamped, Transform, Quaternion, Vector3, Point, Pose
 from visualization_msgs.msg import Marker, InteractiveMarker, InteractiveMarkerControl
-from tf import transformations as tf
 from interactive_markers.interactive_marker_server import InteractiveMarkerServer
 from robot_model import RobotModel, Joint
 from markers import frame
-from linalg import pinv_svd
+from linalg import pinv_svd_solve, pinv_damped_solve, axis_angle, quat_from_mat3, quat_to_mat3, quat_error
+from linalg_nb import compute_q_delta
 
 def alt_orientation_error(T_tgt: numpy.ndarray, T_cur: numpy.ndarray) -> numpy.ndarray:
         """Axis–angle orientation error **ω** in the current end‑effector frame.
 
-        Computes R_err = R_curᵀ · R_tgt and extracts θ·w using
-        ``tf.rotation_from_matrix`` as required in Sheet 9.
+        Computes R_err = R_curᵀ · R_tgt and extracts θ·w directly from it
+        (same result as ``tf.rotation_from_matrix`` used in Sheet 9).
         """
         R_cur = T_cur[0:3, 0:3]
         R_tgt = T_tgt[0:3, 0:3]
-        R_err = R_cur.T @ R_tgt
-        T_err = numpy.eye(4)
-        T_err[0:3, 0:3] = R_err
-        angle, axis, _ = tf.rotation_from_matrix(T_err)
-        if numpy.isclose(angle, 0.0):
-            return numpy.zeros(3)
-        return angle * numpy.array(axis)
+        return axis_angle(R_cur.T @ R_tgt)
+
+def _marker_template():
+    """Create the (pose-less) interactive marker used as target, including its controls"""
+    im = InteractiveMarker()
+    im.header.frame_id = "world"
+    im.name = "target"
+    im.description = "Controller Target"
+    im.scale = 0.2
+
+    # Create a control to move a (sphere) marker around with the mouse
+    control = InteractiveMarkerControl()
+    control.name = "move_3d"
+    control.interaction_mode = InteractiveMarkerControl.MOVE_3D
+    control.markers.extend(frame(numpy.identity(4), scale=0.1, frame_id='').markers)
+    im.controls.append(control)
+
+    # Create arrow controls to move the marker
+    for dir in 'xyz':
+        control = InteractiveMarkerControl()
+        control.name = "move_" + dir
+        control.interaction_mode = InteractiveMarkerControl.MOVE_AXIS
+        control.orientation.x = 1 if dir == 'x' else 0
+        control.orientation.y = 1 if dir == 'y' else 0
+        control.orientation.z = 1 if dir == 'z' else 0
+        control.orientation.w = 1
+        im.controls.append(control)
+
+        # control = InteractiveMarkerControl()
+        # control.name = "rotate_" + dir
+        # control.interaction_mode = InteractiveMarkerControl.ROTATE_AXIS
+        # control.orientation.x = 1 if dir == "x" else 0
+        # control.orientation.y = 1 if dir == "y" else 0
+        # control.orientation.z = 1 if dir == "z" else 0
+        # control.orientation.w = 1
+        # im.controls.append(control)
+    # Create a control to rotate the marker
+
+    return im
+
+
+_IM_TEMPLATE = _marker_template()  # built once, copied for every (re-)created target marker
 
 class MyInteractiveMarkerServer(InteractiveMarkerServer):
     """Server handling interactive rviz markers"""
     def __init__(self, name, T):
         InteractiveMarkerServer.__init__(self, name)
         self.target = numpy.identity(4)
+        self._last_q = None  # marker orientation self.target's rotation was computed from
+        self.dirty = True  # target changed and not yet reached by the controller
         self.create_interactive_marker(T)
 
     def create_interactive_marker(self, T):
-        im = InteractiveMarker()
-        im.header.frame_id = "world"
-        im.name = "target"
-        im.description = "Controller Target"
-        im.scale = 0.2
-        im.pose.position = Point(*T[0:3, 3])
-        im.pose.orientation = Quaternion(*tf.quaternion_from_matrix(T))
+        im = copy.copy(_IM_TEMPLATE)  # shallow copy: controls are shared, pose is replaced below
+        im.pose = Pose(position=Point(*T[0:3, 3]), orientation=Quaternion(*quat_from_mat3(T)))
         self.process_marker_feedback(im)  # set target to initial pose
 
-        # Create a control to move a (sphere) marker around with the mouse
-        control = InteractiveMarkerControl()
-        control.name = "move_3d"
-        control.interaction_mode = InteractiveMarkerControl.MOVE_3D
-        control.markers.extend(frame(numpy.identity(4), scale=0.1, frame_id='').markers)
-        im.controls.append(control)
-
-        # Create arrow controls to move the marker
-        for dir in 'xyz':
-            control = InteractiveMarkerControl()
-            control.name = "move_" + dir
-            control.interaction_mode = InteractiveMarkerControl.MOVE_AXIS
-            control.orientation.x = 1 if dir == 'x' else 0
-            control.orientation.y = 1 if dir == 'y' else 0
-            control.orientation.z = 1 if dir == 'z' else 0
-            control.orientation.w = 1
-            im.controls.append(control)
-
-            # control = InteractiveMarkerControl()
-            # control.name = "rotate_" + dir
-            # control.interaction_mode = InteractiveMarkerControl.ROTATE_AXIS
-            # control.orientation.x = 1 if dir == "x" else 0
-            # control.orientation.y = 1 if dir == "y" else 0
-            # control.orientation.z = 1 if dir == "z" else 0
-            # control.orientation.w = 1
-            # im.controls.append(control)
-        # Create a control to rotate the marker
-
-
         # Add the marker to the server and indicate that processMarkerFeedback should be called
         self.insert(im, self.process_marker_feedback)
 
@@ -84,82 +88,160 @@ class MyInteractiveMarkerServer(InteractiveMarkerServer):
         q = feedback.pose.orientation  # marker orientation as quaternion
         p = feedback.pose.position  # marker position
         # Compute target homogenous transform from marker pose
-        self.target = tf.quaternion_matrix(numpy.array([q.x, q.y, q.z, q.w]))
-        self.target[0:3, 3] = numpy.array([p.x, p.y, p.z])
+        q = (q.x, q.y, q.z, q.w)
+        target = self.target.copy()
+        if q != self._last_q:  # rotation only needs recomputing if the orientation changed
+            target[0:3, 0:3] = quat_to_mat3(*q)
+            self._last_q = q
+        target[0:3, 3] = p.x, p.y, p.z
+        self.target = target  # rebind (rather than modify) so readers never see a half-updated target
+        self.dirty = True
 
 
 
 class Controller(object):
     def __init__(self, pose=TransformStamped(header=Header(frame_id='panda_link8'), child_frame_id='target',
-                                             transform=Transform(rotation=Quaternion(*tf.quaternion_about_axis(numpy.pi/4, [0, 0, 1])),
+                                             transform=Transform(rotation=Quaternion(0, 0, numpy.sin(numpy.pi/8), numpy.cos(numpy.pi/8)),  # π/4 about z
                                                                  translation=Vector3(0, 0, 0.105)))):
 
         self.robot = RobotModel()
         self.robot._add(Joint(pose))  # add a fixed end-effector transform
         self.pub = rospy.Publisher('/target_joint_states', JointState, queue_size=10)
         self.joint_msg = JointState()
-        self.joint_msg.name = [j.name for j in self.robot.active_joints]
-        self.joint_msg.position = numpy.asarray(
+        self.joint_msg.name = tuple(j.name for j in self.robot.active_joints)
+        self.q = numpy.asarray(  # current joint positions (numpy), copied into joint_msg.position on publish
             [(j.min+j.max)/2 + 0.1*(j.max-j.min)*random.uniform(0, 1) for j in self.robot.active_joints])
         self.target_link = pose.child_frame_id
-        self.T, self.J = self.robot.fk(self.target_link, dict(zip(self.joint_msg.name, self.joint_msg.position)))
+        self.variant = "damped"  # pseudo-inverse variant used by solve()
+        self.damping = 0.01  # damping factor λ (maximum damping λ₀ for variant "adaptive")
+        self.sigma_min_threshold = 0.05  # "adaptive": start damping when the smallest singular value drops below
+        self.max_iters = 10  # max. number of IK iterations per control step
+        self.tolerance = 1e-8  # squared error norm considered converged
+        self.momentum = 0.0  # weight of the previous step blended into each new q_delta (opt-in, 0 disables)
+        self.joint_msg.position = self.q.tolist()
+        self._q_fk = numpy.empty_like(self.q)  # joint positions self.T and self.J were computed for
+        self.update_fk()
+
+        # buffers reused by every control step
+        self._xi = numpy.empty(6)  # 6-vector twist error
+        self._pos_buf = numpy.empty(3)  # position error
+        self._q_delta = numpy.empty(self.J.shape[1])  # joint step (fused damped kernel)
+        self._q_delta_prev = numpy.zeros_like(self.q)  # previous joint step (momentum)
+        self._momentum_target = None  # target the steps in self._q_delta_prev were taken towards
+        compute_q_delta(self.J, self.T, self.T, self.damping, self._xi, self._q_delta)  # warm up: trigger JIT compilation now
 
         self.im_server = MyInteractiveMarkerServer("controller", self.T)
 
+    def integrate(self, q_delta):
+        """Change joint angles by q_delta and update kinematics, without publishing"""
+        q_delta = q_delta.ravel()
+        if self.momentum:  # q_delta ← (1-α)·q_delta + α·q_delta_prev
+            q_delta = (1.0 - self.momentum) * q_delta + self.momentum * self._q_delta_prev
+            self._q_delta_prev[:] = q_delta
+        numpy.add(self.q, q_delta, out=self.q)  # add (numpy) vector q_delta to current joint position vector
+        if numpy.max(numpy.abs(self.q - self._q_fk)) < 1e-6:
+            return  # joints (nearly) unchanged since last fk: keep cached kinematics
+        self.update_fk()
+
+    def update_fk(self):
+        """Compute forward kinematics and Jacobian for current joint positions"""
+        T, J = self.robot.fk_array(self.target_link, self.q)
+        # C-contiguous float64 can be handed to LAPACK / numba without hidden copies
+        self.T = numpy.ascontiguousarray(T, dtype=numpy.float64)
+        self.J = numpy.ascontiguousarray(J, dtype=numpy.float64)
+        self._q_fk[:] = self.q
+
+    def publish(self):
+        """Publish current joint state"""
+        self.joint_msg.position = self.q.tolist()  # plain floats serialize faster than numpy scalars
+        self.pub.publish(self.joint_msg)
+
     def actuate(self, q_delta):
         """Move robot by given changes to joint angles"""
-        self.joint_msg.position += q_delta.ravel()  # add (numpy) vector q_delta to current joint position vector
-        self.pub.publish(self.joint_msg)  # publish new joint state
-        joints = dict(zip(self.joint_msg.name, self.joint_msg.position))  # turn list of names and joint values into map
-        self.T, self.J = self.robot.fk(self.target_link, joints)  # compute new forward kinematics and Jacobian
+        self.integrate(q_delta)
+        self.publish()
     
     
     def solve(self, J, error):
         """Inverse velocity kinematics: q_delta = J^+ * error"""
-        return numpy.linalg.pinv(J, 0.01).dot(error)
+        if self.variant == "damped":
+            return pinv_damped_solve(J, error, self.damping)
+        if self.variant == "adaptive":  # damping chosen from the conditioning of J
+            return pinv_svd_solve(J, error, variant="damped", lam=self.damping,
+                                  sigma_min_threshold=self.sigma_min_threshold)
+        if self.variant == "lstsq":  # min-norm solution via gelsd, cutting σ < 0.01·σ_max (relative)
+            return numpy.linalg.lstsq(J, error, rcond=0.01)[0]
+        return pinv_svd_solve(J, error, variant=self.variant, lam=self.damping)
     
     @staticmethod
-    def position_error(T_tgt, T_cur):
-        """Translational error (world frame)"""
-        return T_tgt[0:3, 3] - T_cur[0:3, 3]
+    def position_error(T_tgt, T_cur, out=None):
+        """Translational error (world frame), optionally written into out"""
+        return numpy.subtract(T_tgt[0:3, 3], T_cur[0:3, 3], out=out)
 
     @staticmethod
-    def orientation_error(T_tgt, T_cur):
+    def orientation_error(T_tgt, T_cur, out=None):
         """Compute orientation error
-        ω = θ · w where θ is the rotation angle and w the rotation axis **expressed in the current
-        end‑effector frame**, as required by the exercise sheet (Sheet 9, Task 9.1).
+        ω = θ · w where θ is the rotation angle and w the rotation axis of R_tgt · R_curᵀ **expressed
+        in the world frame**, matching the angular rows of the Jacobian returned by RobotModel.fk.
+        Computed from the quaternion difference q_tgt · q_cur⁻¹, without any 3×3 matrix product.
+        The result is optionally written into out.
         """
-        R_tgt = T_tgt[0:3, 0:3]
-        R_cur = T_cur[0:3, 0:3]
-        # Rotation bringing current into target, represented in EE frame.
-        R_err = R_cur.T.dot(R_tgt)           # R_cur⁻¹ · R_tgt
-        # Extend to 4×4 so tf.rotation_from_matrix accepts it
-        R_err_h = numpy.eye(4)
-        R_err_h[0:3, 0:3] = R_err
-        angle, axis, _ = tf.rotation_from_matrix(R_err_h)
-        return angle * numpy.asarray(axis)
+        return quat_error(quat_from_mat3(T_tgt), quat_from_mat3(T_cur), out)
 
     # -------------------- Controllers --------------------
 
+    # Both controllers iterate the IK step until convergence (at most self.max_iters times),
+    # only publish the final joint state and return whether the target was reached.
+
+    def _track_target(self, target):
+        """Forget momentum from steps towards a previous target (the marker server rebinds target on change)"""
+        if target is not self._momentum_target:
+            self._q_delta_prev.fill(0.0)
+            self._momentum_target = target
+
     def position_control(self, target):
-        v = self.position_error(target, self.T)
-        q_delta = self.solve(self.J[0:3, :], v)
-        self.actuate(q_delta)
+        self._track_target(target)
+        reached = False
+        for _ in range(self.max_iters):
+            v = self.position_error(target, self.T, self._pos_buf)
+            reached = v.dot(v) < self.tolerance
+            if reached:
+                self._q_delta_prev.fill(0.0)  # don't carry momentum over to the next target
+                break
+            self.integrate(self.solve(self.J[0:3, :], v))
+        self.publish()
+        return reached
 
     def pose_control(self, target):
         """6‑D controller combining translation & orientation"""
-        v = self.position_error(target, self.T)
-        w = self.orientation_error(target, self.T)
-        xi = numpy.hstack((v, w))          # 6‑vector twist error
-        q_delta = self.solve(self.J, xi)   # full 6×n Jacobian
-        self.actuate(q_delta)
+        self._track_target(target)
+        xi = self._xi                      # 6‑vector twist error
+        reached = False
+        for _ in range(self.max_iters):
+            if self.variant == "damped":  # fused, JIT-compiled error + solve
+                q_delta = compute_q_delta(self.J, self.T, target, self.damping, xi, self._q_delta)
+            else:
+                self.position_error(target, self.T, xi[0:3])
+                self.orientation_error(target, self.T, xi[3:6])
+                q_delta = None
+            reached = xi.dot(xi) < self.tolerance
+            if reached:
+                self._q_delta_prev.fill(0.0)  # don't carry momentum over to the next target
+                break
+            self.integrate(self.solve(self.J, xi) if q_delta is None else q_delta)   # full 6×n Jacobian
+        self.publish()
+        return reached
 
 
 if __name__ == "__main__":
     rospy.init_node("ik")
     c = Controller()
     rate = rospy.Rate(50)
+    server = c.im_server
     while not rospy.is_shutdown():
-        c.position_control(c.im_server.target)  # full 6‑D control loop
+        if server.dirty:  # only run the controller while the target is not yet reached
+            server.dirty = False  # clear first, so feedback arriving meanwhile re-arms the flag
+            if not c.position_control(server.target):
+                server.dirty = True
         rate.sleep()
     
@@ -1,29 +1,116 @@
+import math
 import numpy as np
+from scipy.linalg.lapack import get_lapack_funcs
+from linalg_nb import quat_from_mat3, quat_error_into  # shared with the JIT-compiled compute_q_delta
 
-def pinv_svd(J, *,
-             variant: str = "plain",
-             eps: float = 1e-4,
-             lam: float = 0.03,
-             lam_min: float = 0.01):
-    
-    U, S, Vt = np.linalg.svd(J, full_matrices=False)
+_gesdd, = get_lapack_funcs(('gesdd',), dtype=np.float64)
+
+
+def _svd(J):
+    """Thin SVD via LAPACK gesdd directly, skipping numpy's validation and finite checks"""
+    U, S, Vt, info = _gesdd(J, compute_uv=1, full_matrices=0, overwrite_a=0)
+    if info != 0:
+        raise np.linalg.LinAlgError(f"gesdd failed with info={info}")
+    return U, S, Vt
 
+
+def _sinv(S, variant, eps, lam, lam_min, sigma_min_threshold=None):
+    """Diagonal of Σ⁺ for the given pseudo-inverse variant"""
     if variant == "plain":
-        Sinv = [1/s if s > 0 else 0 for s in S]
+        return np.where(S > 0, 1/np.maximum(S, 1e-300), 0.0)
 
     elif variant == "clipped":
         # Moore–Penrose but *zero* out small σ
-        Sinv = [0 if s < eps else 1/s for s in S]
+        return np.where(S < eps, 0.0, 1/np.maximum(S, eps))
 
     elif variant == "damped":
         # J⁺ = Jᵀ · (J Jᵀ + λ²I)⁻¹  ⇒  σᵢ /(σᵢ² + λ²)
-        Sinv = [s/(s**2 + lam**2) for s in S]
+        if sigma_min_threshold is not None:
+            # adaptive damping (Nakamura & Hanafusa): λ² = λ₀² (1 - (σ_min/ε)²) near singularities, 0 otherwise
+            ratio = S[-1] / sigma_min_threshold
+            lam = lam * math.sqrt(1.0 - ratio*ratio) if ratio < 1.0 else 0.0
+        return S / (S*S + lam*lam)
 
     elif variant == "smooth":
         # Use MP for large σ, damped formula for small σ (continuous switch)
-        Sinv = [1/s if s > eps else s/(s**2 + lam_min**2) for s in S]
+        return np.where(S > eps, 1/np.maximum(S, eps), S / (S*S + lam_min*lam_min))
 
     else:
         raise ValueError(f"Unknown variant '{variant}'")
 
-    return Vt.T @ np.diag(Sinv) @ U.T
\ No newline at end of file
+
+def pinv_svd(J, *,
+             variant: str = "plain",
+             eps: float = 1e-4,
+             lam: float = 0.03,
+             lam_min: float = 0.01,
+             sigma_min_threshold: float = None):
+
+    U, S, Vt = _svd(J)
+    Sinv = _sinv(S, variant, eps, lam, lam_min, sigma_min_threshold)
+    # J⁺ = V Σ⁺ Uᵀ = (U Σ⁺ Vᵀ)ᵀ: scale columns of U and return a transposed view, no diag(Σ⁺) or V copy
+    return ((U * Sinv) @ Vt).T
+
+
+def pinv_svd_solve(J, b, *,
+                   variant: str = "plain",
+                   eps: float = 1e-4,
+                   lam: float = 0.03,
+                   lam_min: float = 0.01,
+                   sigma_min_threshold: float = None):
+    """Compute J⁺ · b without building J⁺: V · (Σ⁺ · (Uᵀ · b)), using matrix-vector products only"""
+    U, S, Vt = _svd(J)
+    x = b @ U  # = Uᵀ · b
+    x *= _sinv(S, variant, eps, lam, lam_min, sigma_min_threshold)
+    return x @ Vt  # = V · x
+
+
+def pinv_damped_solve(J, b, lam: float = 0.03):
+    """Compute Jᵀ · (J Jᵀ + λ²I)⁻¹ · b by solving the small damped normal equations instead of an SVD"""
+    A = J @ J.T
+    A.flat[::A.shape[0] + 1] += lam*lam  # add λ² to the diagonal
+    return np.linalg.solve(A, b) @ J  # yᵀ · J = Jᵀ · y
+
+
+def axis_angle(R, out=None):
+    """Rotation vector θ·w of a 3×3 rotation matrix R (inverse Rodrigues formula), optionally written into out"""
+    if out is None:
+        out = np.empty(3)
+    cos = 0.5 * (R[0, 0] + R[1, 1] + R[2, 2] - 1.0)
+    angle = math.acos(min(1.0, max(-1.0, cos)))
+    if angle < 1e-9:
+        out[0] = out[1] = out[2] = 0.0
+    elif math.pi - angle < 1e-6:
+        # sin(θ) ≈ 0: recover w from the symmetric part (R + I)/2 = w·wᵀ instead
+        i = max(range(3), key=lambda k: R[k, k])
+        s = angle / math.sqrt(2.0 * (R[i, i] + 1.0))
+        out[0], out[1], out[2] = s * R[0, i], s * R[1, i], s * R[2, i]
+        out[i] += s
+    else:
+        s = angle / (2.0 * math.sin(angle))
+        out[0] = s * (R[2, 1] - R[1, 2])
+        out[1] = s * (R[0, 2] - R[2, 0])
+        out[2] = s * (R[1, 0] - R[0, 1])
+    return out
+
+
+def quat_error(q_tgt, q_cur, out=None):
+    """Rotation vector θ·w of q_tgt · q_cur⁻¹, i.e. of R_tgt · R_curᵀ (world frame), optionally written into out"""
+    if out is None:
+        out = np.empty(3)
+    quat_error_into(q_tgt, q_cur, out)
+    return out
+
+
+def quat_to_mat3(x, y, z, w):
+    """3×3 rotation matrix (as nested tuples) of the quaternion (x, y, z, w), normalizing it on the fly"""
+    n = x*x + y*y + z*z + w*w
+    if n < 1e-12:
+        return (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)
+    s = 2.0 / n
+    xx, yy, zz = s*x*x, s*y*y, s*z*z
+    xy, xz, yz = s*x*y, s*x*z, s*y*z
+    wx, wy, wz = s*w*x, s*w*y, s*w*z
+    return ((1.0 - yy - zz, xy - wz, xz + wy),
+            (xy + wz, 1.0 - xx - zz, yz - wx),
+            (xz - wy, yz + wx, 1.0 - xx - yy))
@@ -0,0 +1,71 @@
+import math
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True, fastmath=True)
+def quat_from_mat3(R):
+    """Unit quaternion (x, y, z, w) of the rotation matrix R[0:3, 0:3] (Shepperd's method)"""
+    tr = R[0, 0] + R[1, 1] + R[2, 2]
+    if tr > 0.0:
+        s = 2.0 * math.sqrt(tr + 1.0)
+        return (R[2, 1] - R[1, 2]) / s, (R[0, 2] - R[2, 0]) / s, (R[1, 0] - R[0, 1]) / s, 0.25 * s
+    if R[0, 0] > R[1, 1] and R[0, 0] > R[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + R[0, 0] - R[1, 1] - R[2, 2])
+        return 0.25 * s, (R[0, 1] + R[1, 0]) / s, (R[0, 2] + R[2, 0]) / s, (R[2, 1] - R[1, 2]) / s
+    if R[1, 1] > R[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + R[1, 1] - R[0, 0] - R[2, 2])
+        return (R[0, 1] + R[1, 0]) / s, 0.25 * s, (R[1, 2] + R[2, 1]) / s, (R[0, 2] - R[2, 0]) / s
+    s = 2.0 * math.sqrt(1.0 + R[2, 2] - R[0, 0] - R[1, 1])
+    return (R[0, 2] + R[2, 0]) / s, (R[1, 2] + R[2, 1]) / s, 0.25 * s, (R[1, 0] - R[0, 1]) / s
+
+
+@njit(cache=True, fastmath=True)
+def quat_error_into(q_tgt, q_cur, out):
+    """Write rotation vector θ·w of q_tgt · q_cur⁻¹ (world frame) into out[0:3]"""
+    ax, ay, az, aw = q_tgt
+    bx, by, bz, bw = q_cur
+    # q_err = q_tgt · conj(q_cur)
+    w = aw*bw + ax*bx + ay*by + az*bz
+    x = bw*ax - aw*bx - (ay*bz - az*by)
+    y = bw*ay - aw*by - (az*bx - ax*bz)
+    z = bw*az - aw*bz - (ax*by - ay*bx)
+    if w < 0.0:  # q and -q are the same rotation: pick the shorter way round
+        w, x, y, z = -w, -x, -y, -z
+    n = math.sqrt(x*x + y*y + z*z)
+    s = 2.0 * math.atan2(n, w) / n if n > 1e-12 else 2.0  # θ/sin(θ/2) → 2 for θ → 0
+    out[0] = s * x
+    out[1] = s * y
+    out[2] = s * z
+
+
+@njit(cache=True, fastmath=True)
+def compute_q_delta(J, T_cur, T_tgt, lam, xi, q_delta):
+    """Fused 6-D pose step: q_delta = Jᵀ · (J Jᵀ + λ²I)⁻¹ · [v; ω]
+
+    v and ω are the position error and the world-frame orientation error (q_tgt · q_cur⁻¹),
+    matching Controller.position_error and Controller.orientation_error.
+    The twist error [v; ω] is written into the 6-vector xi (e.g. for convergence checks),
+    the result into (and returned as) the preallocated n-vector q_delta.
+    """
+    m, n = J.shape
+    for k in range(3):
+        xi[k] = T_tgt[k, 3] - T_cur[k, 3]
+
+    quat_error_into(quat_from_mat3(T_tgt), quat_from_mat3(T_cur), xi[3:6])
+
+    A = np.empty((m, m))
+    for i in range(m):
+        for j in range(i + 1):
+            s = 0.0
+            for k in range(n):
+                s += J[i, k] * J[j, k]
+            A[i, j] = A[j, i] = s
+        A[i, i] += lam * lam
+    y = np.linalg.solve(A, xi[:m])
+
+    q_delta[:] = 0.0
+    for i in range(m):
+        for k in range(n):
+            q_delta[k] += J[i, k] * y[i]
+    return q_delta
@@ -116,6 +116,7 @@ class RobotModel:
         self.links = {}  # map link names to its parent joints
         self.joints = {}  # map joint names to joint instances
         self.active_joints = []  # list of active, non-mimic joints
+        self.active_index = {}  # map active joint names to their index into active_joints
 
         description = rospy.get_param(param)  # fetch URDF from ROS parameter server
         doc = xml.dom.minidom.parseString(description)  # parse URDF string into dom
@@ -127,6 +128,7 @@ class RobotModel:
         """Add a single joint to the kinematic tree"""
         self.joints[joint.name] = joint
         if joint.active and joint.mimic is None:
+            self.active_index[joint.name] = len(self.active_joints)
             self.active_joints.append(joint)
         if joint.mimic is not None:
             joint.mimic.joint = self.joints[joint.mimic.joint]  # replace name with instance
@@ -136,16 +138,24 @@ class RobotModel:
 
     def fk(self, link, joints):
         """Compute forward kinematics up to given link using given map of joint angles"""
+        return self._fk(link, lambda joint: joints[joint.name])
+
+    def fk_array(self, link, positions):
+        """Compute forward kinematics up to given link using joint angles ordered as self.active_joints"""
+        return self._fk(link, lambda joint: positions[self.active_index[joint.name]])
+
+    def _fk(self, link, lookup):
+        """Compute forward kinematics up to given link, fetching active joint angles via lookup(joint)"""
         def value(joint):
-            """Get joint value from joints, considering mimic joints"""
+            """Get joint value via lookup, considering mimic joints"""
             if joint.mimic is None:
-                return joints[joint.name]
+                return lookup(joint)
             return joint.mimic.multiplier * value(joint.mimic.joint) + joint.mimic.offset
 
         def index(joint):
             """Get joint index (into self.active_joint) and the velocity scaling factor"""
             if joint.mimic is None:
-                return next((i for i, j in enumerate(self.active_joints) if j is joint), None), 1.0
+                return self.active_index.get(joint.name), 1.0
             idx, scale = index(joint.mimic.joint)
             return idx, joint.mimic.multiplier * scale
 